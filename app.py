@@ -4,6 +4,7 @@ from PIL import Image
 from dotenv import load_dotenv
 import io
 import base64 # Needed for download button
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
 
 # --- Load .env file VERY FIRST ---
 load_dotenv()
@@ -34,7 +35,12 @@ default_keys = {
     "generated_img_description": None,
     "current_style_name": None,
     "current_style_key": None,
-    "content_img_display": None # To hold the original image for display
+    "content_img_display": None, # To hold the original image for display
+    # Speculative work started on upload, consumed when Generate is pressed
+    "prefetch_upload_id": None,
+    "description_future": None,
+    "explanation_future": None,
+    "explanation_style_key": None
 }
 for key, default_value in default_keys.items():
     if key not in st.session_state:
@@ -60,8 +66,46 @@ def load_style_engine():
         print(f"Style Engine Initialization failed: {e}")
         return None
 
+# --- Shared pool for speculative work started before Generate is pressed ---
+PREFETCH_WORKERS = 8
+PREFETCH_WAIT_TIMEOUT = 30 # Seconds to wait for an in-flight prefetch before recomputing
+
+@st.cache_resource
+def load_prefetch_executor():
+    """Thread pool shared by all sessions for describing uploads ahead of time."""
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+def cancel_prefetch():
+    """Cancels this session's speculative work (e.g. when the upload changes)."""
+    for key in ("description_future", "explanation_future"):
+        future = st.session_state[key]
+        if future is not None:
+            future.cancel() # No-op if already running; the result is simply dropped
+        st.session_state[key] = None
+    st.session_state.prefetch_upload_id = None
+    st.session_state.explanation_style_key = None
+
+def prefetched_result(future: Future | None, label: str):
+    """
+    Returns a speculative result, or None if the caller should compute it inline:
+    no prefetch, still queued behind other sessions' work (cancelled here),
+    slower than PREFETCH_WAIT_TIMEOUT, or failed (reported on the script thread).
+    """
+    if future is None or future.cancelled() or future.cancel():
+        return None
+    try:
+        return future.result(timeout=PREFETCH_WAIT_TIMEOUT) # Already running or done
+    except FutureTimeoutError:
+        print(f"Background {label} still running after {PREFETCH_WAIT_TIMEOUT}s, recomputing.")
+        return None
+    except Exception as e:
+        st.warning(f"Background {label} failed ({e}). Retrying...")
+        print(f"Speculative prefetch ({label}) failed, recomputing: {e}")
+        return None
+
 # --- Load the engine ---
 engine = load_style_engine()
+prefetch_executor = load_prefetch_executor()
 
 # Stop execution if engine failed to load
 if not engine:
@@ -93,6 +137,17 @@ with col_input:
     else:
          st.session_state.content_img_display = None # Clear if no file is uploaded
 
+    # Start describing a new upload right away, while the user is still choosing settings
+    upload_id = uploaded_file.file_id if uploaded_file is not None else None
+    if upload_id != st.session_state.prefetch_upload_id:
+        cancel_prefetch()
+        if upload_id and st.session_state.content_img_display:
+            st.session_state.prefetch_upload_id = upload_id
+            st.session_state.description_future = prefetch_executor.submit(
+                engine._get_image_description, st.session_state.content_img_display,
+                raise_errors=True # No ScriptRunContext on pool threads: surface errors via the future
+            )
+
 
     # --- Style Selection ---
     style_key = st.selectbox(
@@ -103,6 +158,17 @@ with col_input:
         disabled=(uploaded_file is None) # Disable if no image uploaded
     )
 
+    # Warm the style explanation for the currently selected style as well. While an
+    # earlier explanation is still running, don't start another one per style browsed;
+    # a later rerun catches up (or Generate explains inline).
+    explanation_future = st.session_state.explanation_future
+    if (st.session_state.prefetch_upload_id and style_key != st.session_state.explanation_style_key
+            and (explanation_future is None or explanation_future.done() or explanation_future.cancel())):
+        st.session_state.explanation_future = prefetch_executor.submit(
+            explain, STYLES[style_key]['style_name'], STYLES[style_key]
+        )
+        st.session_state.explanation_style_key = style_key
+
     # --- Generation Parameters ---
     st.subheader("⚙️ Generation Parameters")
     dalle_size = st.selectbox(
@@ -178,21 +244,34 @@ with col_output:
             # --- Call Image Generation ---
             # Use a single spinner for the multi-step generation process
             with st.spinner(f"Generating ({style_name_display})... Step 1/3: Analyzing input image..."):
+                # Usually already finished in the background since the upload
+                prefetched_description = prefetched_result(st.session_state.description_future, "image analysis")
                 stylized_image, img_description = engine.apply_style(
                     content_img=st.session_state.content_img_display, # Use image from state
                     style_cfg=selected_style_config,
                     negative_prompt=st.session_state.negative_prompt,
                     size=st.session_state.dalle_size,
                     quality=st.session_state.dalle_quality,
-                    dalle_style=st.session_state.dalle_style_param # Use unique key here
+                    dalle_style=st.session_state.dalle_style_param, # Use unique key here
+                    image_description=prefetched_description
                 )
                 st.session_state.generated_img_description = img_description # Save description
+                if img_description and not prefetched_description and st.session_state.prefetch_upload_id:
+                    # Described inline (prefetch was cancelled or failed): keep it for later
+                    # Generates on the same upload, as a finished prefetch would be
+                    described = Future()
+                    described.set_result(img_description)
+                    st.session_state.description_future = described
 
             # --- Process if Image Generation Successful ---
             if stylized_image:
                 # --- Generate Explanations ---
                 with st.spinner(f"Generating ({style_name_display})... Step 2/3: Initial explanation..."):
-                    initial_explanation = explain(style_name_display, selected_style_config)
+                    initial_explanation = None
+                    if st.session_state.explanation_style_key == style_key:
+                        initial_explanation = prefetched_result(st.session_state.explanation_future, "style explanation")
+                    if not initial_explanation or initial_explanation.startswith("Error"):
+                        initial_explanation = explain(style_name_display, selected_style_config)
                     st.session_state.messages.append({"role": "assistant", "content": f"**About {style_name_display} Style:**\n{initial_explanation}"})
 
                 with st.spinner(f"Generating ({style_name_display})... Step 3/3: Analyzing generated image..."):
@@ -1,11 +1,13 @@
 # image_engine.py
 import os
+import time
 import base64
 from io import BytesIO
 from PIL import Image
 from dotenv import load_dotenv
 import streamlit as st
 from openai import OpenAI, OpenAIError
+from vision_detail import select_detail, prepare_image, record_vision_usage
 
 load_dotenv()
 
@@ -28,15 +30,25 @@ class StyleEngine:
             print(f"OpenAI Client Initialization failed: {e}")
             raise
 
-    def _get_image_description(self, image: Image.Image) -> str | None:
-        """Analyzes the image using GPT-4o and returns a detailed description."""
+    def _get_image_description(self, image: Image.Image, raise_errors: bool = False) -> str | None:
+        """
+        Analyzes the image using GPT-4o and returns a detailed description.
+        With `raise_errors`, failures are raised instead of shown via st.error
+        (for background threads, where Streamlit calls are dropped).
+        """
         # --- (Keep this function exactly as it is in your current code) ---
         if not self.client:
+            if raise_errors:
+                raise RuntimeError("OpenAI client is not initialized.")
             st.error("OpenAI client is not initialized.")
             return None
 
         print("➡️ Analyzing image content with GPT-4o...")
         try:
+            # Pick detail level / tile budget from local complexity, then shrink to match
+            detail_plan = select_detail(image, fixed_detail="high")
+            image = prepare_image(image, detail_plan)
+
             # Convert PIL Image to base64 string
             buffered = BytesIO()
             image_format = image.format if image.format in ["JPEG", "PNG"] else "PNG"
@@ -44,6 +56,7 @@ class StyleEngine:
             img_bytes = buffered.getvalue()
             img_base64 = base64.b64encode(img_bytes).decode('utf-8')
 
+            start_time = time.perf_counter()
             response = self.client.chat.completions.create(
                 model=VISION_MODEL,
                 messages=[
@@ -58,7 +71,7 @@ class StyleEngine:
                                 "type": "image_url",
                                 "image_url": {
                                     "url": f"data:image/{image_format.lower()};base64,{img_base64}",
-                                    "detail": "high"
+                                    "detail": detail_plan["detail"]
                                 },
                             },
                         ],
@@ -66,15 +79,20 @@ class StyleEngine:
                 ],
                 max_tokens=300
             )
+            record_vision_usage("image_description", detail_plan, image.size, response, time.perf_counter() - start_time)
             description = response.choices[0].message.content.strip()
             print(f"✅ Image description received: {description[:100]}...")
             return description
 
         except OpenAIError as e:
+            if raise_errors:
+                raise
             st.error(f"OpenAI Vision API Error: {e.message} (Status code: {e.status_code})")
             print(f"OpenAI Vision API Error: {e}")
             return None
         except Exception as e:
+            if raise_errors:
+                raise
             st.error(f"An unexpected error occurred during image analysis: {e}")
             print(f"Unexpected error during image analysis: {e}")
             return None
@@ -145,11 +163,13 @@ class StyleEngine:
                     negative_prompt: str = "",
                     size: str = "1024x1024",
                     quality: str = "standard",
-                    dalle_style: str = "vivid"
+                    dalle_style: str = "vivid",
+                    image_description: str | None = None
                    ) -> tuple[Image.Image | None, str | None]: # Return image and description
         """
         Applies style by:
-        1. Getting description of content_img.
+        1. Getting description of content_img (skipped if `image_description`
+           was already fetched, e.g. speculatively on upload).
         2. Combining description, style prompt, and negative prompt.
         3. Generating image using DALL-E with specified parameters.
         Returns the generated image and the description used.
@@ -159,9 +179,9 @@ class StyleEngine:
         style_details_prompt = style_cfg.get("prompt", f"in the style of {style_name}.")
 
         # --- Step 1: Get Image Description ---
-        image_description = None # Initialize
         # Add spinner in app.py, not here
-        image_description = self._get_image_description(content_img)
+        if not image_description:
+            image_description = self._get_image_description(content_img)
 
         if not image_description:
             st.error("Could not get a description of the uploaded image. Cannot proceed.")
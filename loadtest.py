@@ -0,0 +1,515 @@
+# loadtest.py
+"""
+Load test for the style-transfer pipeline.
+
+Simulates N concurrent Streamlit sessions (upload -> speculative describe ->
+Generate -> tutor explanations -> follow-up chat), calling the same engine and
+tutor functions app.py uses, against a local stand-in for the OpenAI API that
+injects latency. The stand-in runs in its own process so its threads, memory
+and CPU stay out of the figures. Reports throughput, per-stage latency, RSS
+growth per session and thread counts.
+
+Usage:
+    python loadtest.py --sessions 50 --concurrency 20
+    python loadtest.py --sessions 20 --image-latency 8 --max-inflight 10 --json
+"""
+import gc
+import os
+import io
+import ctypes
+import sys
+import json
+import math
+import time
+import base64
+import random
+import logging
+import argparse
+import threading
+import contextlib
+import multiprocessing
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from PIL import Image
+import vision_detail
+from vision_detail import estimate_vision_tokens, summarize_usage
+
+# --- Stand-in OpenAI API ---
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers chat completions and image generations after an injected delay."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass # Keep the report readable
+
+    def do_GET(self):
+        if self.path == "/loadtest/stats":
+            with self.server.lock:
+                stats = {"rejected": self.server.rejected}
+            self._send(200, stats)
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        with server.lock:
+            rejected = bool(server.max_inflight and server.inflight >= server.max_inflight)
+            if rejected:
+                server.rejected += 1
+            else:
+                server.inflight += 1
+        if rejected: # Respond outside the lock so other handlers aren't stalled
+            return self._send(429, {"error": {"message": "Rate limit reached (stand-in)", "type": "requests", "code": "rate_limit_exceeded"}})
+        try:
+            if self.path.endswith("/chat/completions"):
+                detail = _image_detail(body)
+                latency = server.latency["vision" if detail else "text"]
+                time.sleep(_jittered(latency, server.jitter))
+                prompt_tokens = 100 + (_vision_tokens(body, detail) if detail else 0)
+                self._send(200, {
+                    "id": "chatcmpl-loadtest", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "gpt-4o"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": server.reply_text}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 60, "total_tokens": prompt_tokens + 60},
+                })
+            elif self.path.endswith("/images/generations"):
+                time.sleep(_jittered(server.latency["image"], server.jitter))
+                self._send(200, {"created": int(time.time()), "data": [{"b64_json": server.image_b64(body.get("size", "1024x1024"))}]})
+            else:
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+        finally:
+            with server.lock:
+                server.inflight -= 1
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _jittered(latency: float, jitter: float) -> float:
+    return max(0.0, latency * (1 + random.uniform(-jitter, jitter)))
+
+
+def _image_detail(body: dict) -> str | None:
+    """Returns the `detail` of the first image in a chat request, or None for text-only requests."""
+    for message in body.get("messages", []):
+        if isinstance(message.get("content"), list):
+            for part in message["content"]:
+                if part.get("type") == "image_url":
+                    return part["image_url"].get("detail", "auto")
+    return None
+
+
+def _vision_tokens(body: dict, detail: str) -> int:
+    for message in body.get("messages", []):
+        if isinstance(message.get("content"), list):
+            for part in message["content"]:
+                if part.get("type") == "image_url":
+                    encoded = part["image_url"]["url"].split(",", 1)[1]
+                    with Image.open(io.BytesIO(base64.b64decode(encoded))) as img:
+                        return estimate_vision_tokens(*img.size, detail)
+    return 0
+
+
+def serve_fake_openai(latency: dict, jitter: float, max_inflight: int, port_queue):
+    """Runs the stand-in API on a free local port (target of the stand-in process)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency, server.jitter, server.max_inflight = latency, jitter, max_inflight
+    server.lock, server.inflight, server.rejected = threading.Lock(), 0, 0
+    server.reply_text = ("A wide shot of a harbor at dusk with fishing boats in the foreground, "
+                         "warm orange light reflecting on calm water and hills in the background.")
+    images = {}
+
+    def image_b64(size: str) -> str:
+        with server.lock:
+            if size not in images:
+                width, height = (int(v) for v in size.split("x"))
+                buffered = io.BytesIO()
+                Image.fromarray(photo_like_pixels(width, height, seed=0)).save(buffered, format="PNG")
+                images[size] = base64.b64encode(buffered.getvalue()).decode("utf-8")
+            return images[size]
+
+    server.image_b64 = image_b64
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_fake_openai(latency: dict, jitter: float, max_inflight: int) -> tuple:
+    """Starts the stand-in API in a separate process; returns (process, base URL)."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_fake_openai, args=(latency, jitter, max_inflight, port_queue),
+        name="fake-openai", daemon=True,
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+
+def fake_openai_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/loadtest/stats", timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+# --- Process metrics ---
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def thread_counts() -> Counter:
+    """Live threads grouped by pool name prefix ("session", "prefetch", ...), plus "total"."""
+    counts = Counter(t.name.split("_")[0] if "_" in t.name else "other" for t in threading.enumerate())
+    counts["total"] = sum(counts.values())
+    return counts
+
+
+def settled_rss_mb() -> float:
+    """RSS after a GC pass and returning freed heap pages to the OS (glibc), for stable baselines."""
+    gc.collect()
+    with contextlib.suppress(OSError, AttributeError):
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    return current_rss_mb()
+
+
+class ResourceMonitor(threading.Thread):
+    """Samples RSS and live thread counts until stopped."""
+    def __init__(self, interval: float = 0.1):
+        super().__init__(name="loadtest-monitor", daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append((current_rss_mb(), thread_counts()))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# --- Simulated session ---
+def photo_like_pixels(width: int, height: int, seed: int) -> np.ndarray:
+    """Smooth color gradient plus mild noise, so encoded sizes resemble real photos."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    return np.clip(base + rng.normal(0, 8, (height, width, 3)), 0, 255).astype(np.uint8)
+
+
+def make_upload(width: int, height: int, seed: int) -> bytes:
+    """Builds the JPEG bytes a user would upload."""
+    buffered = io.BytesIO()
+    Image.fromarray(photo_like_pixels(width, height, seed)).save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+def run_session(session_id: int, args, engine, tutor, styles: dict, prefetch_executor, timings, sessions_state):
+    """
+    Mirrors one user's path through app.py and records per-stage latency.
+    Prefetched stages are timed inside the pool task ("describe"/"explain");
+    the time the session then blocks on them is "describe_wait"/"explain_wait".
+    A describe that is not prefetched happens inside apply_style ("generate").
+    Tutor calls that return an "Error..." string are counted as "<stage>_error"
+    instead of latency samples, and their session as degraded; a failed
+    generate ("generate_error") fails the session.
+    """
+    def timed(stage: str, fn, *fn_args, **fn_kwargs):
+        start = time.perf_counter()
+        result = fn(*fn_args, **fn_kwargs)
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def tutor_call(stage: str, fn, *fn_args):
+        start = time.perf_counter()
+        result = fn(*fn_args)
+        if result.startswith("Error"): # tutor.py reports failures as text
+            timings[f"{stage}_error"].append(time.perf_counter() - start)
+        else:
+            timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def prefetched(stage: str, future):
+        """Same policy as app.py's prefetched_result: None means compute inline."""
+        if future is None:
+            return None
+        if future.cancel(): # Still queued behind other sessions' work
+            timings[f"{stage}_fallback"].append(0.0)
+            return None
+        start = time.perf_counter()
+        try:
+            return future.result(timeout=args.prefetch_timeout)
+        except Exception: # Timed out or failed in the background
+            timings[f"{stage}_fallback"].append(0.0)
+            return None
+        finally:
+            timings[f"{stage}_wait"].append(time.perf_counter() - start)
+
+    session_start = time.perf_counter()
+    state = {"messages": []} # Stand-in for st.session_state; kept alive like a real session
+    style_key = random.Random(session_id).choice(list(styles))
+    style_cfg = styles[style_key]
+
+    upload = make_upload(args.upload_width, args.upload_height, session_id)
+    state["content_img_display"] = timed("upload_decode", lambda: Image.open(io.BytesIO(upload)).convert("RGB"))
+
+    description_future = explanation_future = None
+    if prefetch_executor:
+        description_future = prefetch_executor.submit(
+            timed, "describe", engine._get_image_description, state["content_img_display"], raise_errors=True
+        )
+        explanation_future = prefetch_executor.submit(tutor_call, "explain", tutor.explain, style_cfg["style_name"], style_cfg)
+    time.sleep(args.think_time) # User tweaks size/quality/negative prompt before clicking Generate
+
+    # A missing description is described once, inline, by apply_style - as in app.py
+    description = prefetched("describe", description_future)
+    start = time.perf_counter()
+    stylized_image, description = engine.apply_style(
+        content_img=state["content_img_display"], style_cfg=style_cfg, size=args.size, image_description=description
+    )
+    timings["generate" if stylized_image else "generate_error"].append(time.perf_counter() - start)
+    if not stylized_image:
+        timings["failed_sessions"].append(session_id)
+        return
+
+    explanation = prefetched("explain", explanation_future)
+    if not explanation or explanation.startswith("Error"): # app.py recomputes these
+        explanation = tutor_call("explain", tutor.explain, style_cfg["style_name"], style_cfg)
+    state["messages"].append({"role": "assistant", "content": explanation})
+    analysis = tutor_call("analyze_generated", tutor.explain_generated_image, stylized_image, style_cfg)
+    state["messages"].append({"role": "assistant", "content": analysis})
+
+    buffered = io.BytesIO()
+    timed("encode_download", stylized_image.save, buffered, format="PNG")
+    state["generated_img_data"] = buffered.getvalue()
+    state["generated_img_description"] = description
+
+    for turn in range(args.follow_ups):
+        state["messages"].append({"role": "user", "content": f"Question {turn + 1}: how is color used in this style?"})
+        answer = tutor_call("follow_up", tutor.answer_follow_up, state["messages"], style_cfg["style_name"])
+        state["messages"].append({"role": "assistant", "content": answer})
+
+    sessions_state.append(state)
+    if any(m["role"] == "assistant" and m["content"].startswith("Error") for m in state["messages"]):
+        timings["degraded_sessions"].append(session_id)
+    else:
+        timings["session_total"].append(time.perf_counter() - session_start)
+
+
+# --- Reporting ---
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def state_size_mb(state: dict) -> float:
+    """Memory a session keeps in st.session_state: decoded images, download bytes and chat text."""
+    size = 0
+    for value in state.values():
+        if isinstance(value, Image.Image):
+            size += value.width * value.height * len(value.getbands())
+        elif isinstance(value, (bytes, str)):
+            size += len(value)
+        elif isinstance(value, list):
+            size += sum(len(message["content"]) for message in value)
+    return size / 2**20
+
+
+def build_report(args, timings, wall_time: float, rss_before: float, rss_after: float, monitor, server_stats: dict, sessions_state: list) -> dict:
+    completed = len(timings["session_total"]) # Finished without any error
+    degraded = len(timings["degraded_sessions"]) # Finished, but a tutor call returned an error
+    stages, fallbacks, errors = {}, {}, {}
+    for stage, values in timings.items():
+        if stage.endswith("_fallback"):
+            fallbacks[stage.removesuffix("_fallback")] = len(values)
+            continue
+        if stage.endswith("_error"):
+            errors[stage.removesuffix("_error")] = len(values)
+            continue
+        if stage in ("failed_sessions", "degraded_sessions") or not values:
+            continue
+        stages[stage] = {
+            "count": len(values),
+            "p50_s": round(percentile(values, 50), 3),
+            "p95_s": round(percentile(values, 95), 3),
+            "max_s": round(max(values), 3),
+        }
+    rss_samples = [rss for rss, _ in monitor.samples] or [rss_after]
+    thread_samples = [threads for _, threads in monitor.samples] or [thread_counts()]
+    threads_peak = {group: max(sample.get(group, 0) for sample in thread_samples)
+                    for group in sorted(set().union(*thread_samples))}
+    return {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "completed_sessions": completed,
+        "degraded_sessions": degraded,
+        "failed_sessions": len(timings["failed_sessions"]),
+        "wall_time_s": round(wall_time, 2),
+        "throughput_sessions_per_s": round(completed / wall_time, 3) if wall_time else 0.0,
+        "stages": stages,
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_mb": round(rss_after, 1),
+        "rss_peak_mb": round(max(rss_samples), 1),
+        # Measured after a warm-up session, so one-time costs aren't spread over N
+        "rss_growth_per_session_mb": round((rss_after - rss_before) / max(completed + degraded, 1), 2),
+        "state_per_session_mb": round(sum(map(state_size_mb, sessions_state)) / max(len(sessions_state), 1), 2),
+        "threads_peak": threads_peak,
+        "threads_after": threading.active_count(),
+        "prefetch_fallbacks": fallbacks,
+        "stage_errors": errors,
+        "rate_limited_requests": server_stats["rejected"],
+        "vision_usage": summarize_usage(),
+    }
+
+
+def print_report(report: dict):
+    print(f"\n📈 Load test: {report['completed_sessions']}/{report['sessions']} sessions completed "
+          f"({report['degraded_sessions']} degraded, {report['failed_sessions']} failed), concurrency {report['concurrency']}")
+    print(f"   Wall time: {report['wall_time_s']}s, throughput: {report['throughput_sessions_per_s']} sessions/s")
+    print(f"\n   {'stage':<18}{'count':>7}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for stage, stats in report["stages"].items():
+        print(f"   {stage:<18}{stats['count']:>7}{stats['p50_s']:>10}{stats['p95_s']:>10}{stats['max_s']:>10}")
+    print(f"\n   RSS: {report['rss_before_mb']} -> {report['rss_after_mb']} MB "
+          f"(peak {report['rss_peak_mb']} MB, {report['rss_growth_per_session_mb']} MB/session after warm-up)")
+    print(f"   Session state held per session: {report['state_per_session_mb']} MB")
+    peaks = ", ".join(f"{group} {count}" for group, count in report["threads_peak"].items())
+    print(f"   Threads: peak {peaks}; after run {report['threads_after']}")
+    if report["prefetch_fallbacks"]:
+        fallbacks = ", ".join(f"{stage} {count}" for stage, count in report["prefetch_fallbacks"].items())
+        print(f"   Prefetches skipped or failed (computed inline): {fallbacks}")
+    if report["stage_errors"]:
+        errors = ", ".join(f"{stage} {count}" for stage, count in report["stage_errors"].items())
+        print(f"   Stage calls that returned errors (excluded from latency): {errors}")
+    print(f"   Requests rejected by stand-in rate limit: {report['rate_limited_requests']}")
+    for key, stats in report["vision_usage"].items():
+        print(f"   Vision {key}: {stats['count']} calls, detail={stats['detail']}, "
+              f"mean prompt tokens {stats['mean_prompt_tokens']}, p95 latency {stats['p95_latency_s']}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent Art Style Transfer Tutor sessions against a fake OpenAI API.")
+    parser.add_argument("--sessions", type=int, default=20, help="Total simulated sessions.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Sessions running at once (default: all).")
+    parser.add_argument("--follow-ups", type=int, default=2, help="Follow-up chat questions per session.")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Seconds between upload and Generate.")
+    parser.add_argument("--no-prefetch", action="store_true", help="Describe only after Generate (pre-prefetch behavior).")
+    parser.add_argument("--prefetch-workers", type=int, default=8, help="Shared prefetch pool size (app.py PREFETCH_WORKERS).")
+    parser.add_argument("--prefetch-timeout", type=float, default=30.0, help="Max wait on a running prefetch (app.py PREFETCH_WAIT_TIMEOUT).")
+    parser.add_argument("--vision-latency", type=float, default=2.0, help="Seconds per vision chat call.")
+    parser.add_argument("--text-latency", type=float, default=0.8, help="Seconds per text chat call.")
+    parser.add_argument("--image-latency", type=float, default=6.0, help="Seconds per DALL-E generation.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative +/- latency jitter.")
+    parser.add_argument("--max-inflight", type=int, default=0, help="Stand-in returns 429 above this many concurrent requests (0 = unlimited).")
+    parser.add_argument("--upload-width", type=int, default=1600)
+    parser.add_argument("--upload-height", type=int, default=1200)
+    parser.add_argument("--size", default="1024x1024", choices=("1024x1024", "1792x1024", "1024x1792"))
+    parser.add_argument("--warmup-sessions", type=int, default=None, help="Untimed sessions run before the RSS baseline (default: concurrency).")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's console output.")
+    args = parser.parse_args(argv)
+    args.concurrency = args.concurrency or args.sessions
+    if args.warmup_sessions is None:
+        args.warmup_sessions = args.concurrency
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server_process, base_url = start_fake_openai(
+        {"vision": args.vision_latency, "text": args.text_latency, "image": args.image_latency},
+        args.jitter, args.max_inflight,
+    )
+    # Must be set before tutor.py / image_engine.py create their OpenAI clients
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-loadtest"
+
+    import tutor
+    from image_engine import StyleEngine
+    from styles import STYLES
+
+    timings = defaultdict(list)
+    sessions_state = []
+    session_errors = []
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+            stack.enter_context(contextlib.redirect_stderr(devnull))
+            # st.* calls off a script thread log "missing ScriptRunContext" via Streamlit's own handlers
+            for name in list(logging.root.manager.loggerDict):
+                if name.startswith("streamlit"):
+                    logging.getLogger(name).setLevel(logging.ERROR)
+        engine = StyleEngine()
+        prefetch_executor = None if args.no_prefetch else ThreadPoolExecutor(args.prefetch_workers, thread_name_prefix="prefetch")
+
+        sessions = stack.enter_context(ThreadPoolExecutor(args.concurrency, thread_name_prefix="session"))
+
+        # Warm-up wave: pays one-time costs (lazy imports, connection pools, per-thread
+        # allocator arenas, peak working set) before the RSS baseline, so growth is not
+        # spread over however many sessions run; its timings and usage are discarded
+        warmup = [
+            sessions.submit(run_session, args.sessions + i, args, engine, tutor, STYLES, prefetch_executor, defaultdict(list), [])
+            for i in range(args.warmup_sessions)
+        ]
+        for future in warmup:
+            future.exception()
+        vision_detail.USAGE_LOG.clear()
+        rejected_before = fake_openai_stats(base_url)["rejected"]
+
+        monitor = ResourceMonitor()
+        rss_before = settled_rss_mb()
+        monitor.start()
+        start = time.perf_counter()
+        futures = [
+            sessions.submit(run_session, i, args, engine, tutor, STYLES, prefetch_executor, timings, sessions_state)
+            for i in range(args.sessions)
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                timings["failed_sessions"].append(str(e))
+                session_errors.append(str(e))
+        wall_time = time.perf_counter() - start
+        rss_after = settled_rss_mb()
+        monitor.stop()
+        if prefetch_executor:
+            prefetch_executor.shutdown()
+
+    for error in session_errors:
+        print(f"Session failed: {error}", file=sys.stderr)
+    try:
+        server_stats = fake_openai_stats(base_url)
+        server_stats["rejected"] -= rejected_before
+    finally:
+        server_process.terminate()
+        server_process.join()
+    report = build_report(args, timings, wall_time, rss_before, rss_after, monitor, server_stats, sessions_state)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0 if report["failed_sessions"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
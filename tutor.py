@@ -1,10 +1,12 @@
 # tutor.py
 import os
+import time
 import base64
 from io import BytesIO
 from PIL import Image
 from openai import OpenAI, OpenAIError
 from dotenv import load_dotenv
+from vision_detail import select_detail, prepare_image, record_vision_usage
 
 load_dotenv()
 
@@ -85,6 +87,10 @@ def explain_generated_image(generated_image: Image.Image, style_cfg: dict) -> st
 
     print(f"➡️ Analyzing generated image for {style_name} style...")
     try:
+        # Analysis stays at "low" detail (no complexity estimate); adaptive mode only trims the upload
+        detail_plan = select_detail(generated_image, fixed_detail="low", ceiling="low")
+        generated_image = prepare_image(generated_image, detail_plan)
+
         # Convert PIL Image to base64
         buffered = BytesIO()
         image_format = generated_image.format if generated_image.format in ["JPEG", "PNG"] else "PNG"
@@ -97,6 +103,7 @@ def explain_generated_image(generated_image: Image.Image, style_cfg: dict) -> st
             style_tags_string=tags_string
         )
 
+        start_time = time.perf_counter()
         response = client.chat.completions.create(
             model=VISION_MODEL, # Use vision model here
             messages=[
@@ -114,7 +121,7 @@ def explain_generated_image(generated_image: Image.Image, style_cfg: dict) -> st
                             "type": "image_url",
                             "image_url": {
                                 "url": f"data:image/{image_format.lower()};base64,{img_base64}",
-                                "detail": "low" # Low detail might be sufficient and faster/cheaper
+                                "detail": detail_plan["detail"] # Low detail might be sufficient and faster/cheaper
                             },
                         },
                     ],
@@ -122,6 +129,7 @@ def explain_generated_image(generated_image: Image.Image, style_cfg: dict) -> st
             ],
             max_tokens=150 # Keep analysis concise
         )
+        record_vision_usage("generated_analysis", detail_plan, generated_image.size, response, time.perf_counter() - start_time)
         analysis = response.choices[0].message.content.strip()
         print("✅ Generated image analysis received.")
         return analysis
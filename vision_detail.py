@@ -0,0 +1,157 @@
+# vision_detail.py
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+import numpy as np
+from PIL import Image
+
+# --- Configuration ---
+# "adaptive" picks the vision `detail` level from a local complexity estimate.
+# "fixed" keeps whatever detail level the caller asks for (previous behavior).
+VISION_DETAIL_MODES = ("adaptive", "fixed")
+VISION_DETAIL_MODE = os.getenv("VISION_DETAIL_MODE", "adaptive").lower()
+if VISION_DETAIL_MODE not in VISION_DETAIL_MODES:
+    print(f"⚠️ Unknown VISION_DETAIL_MODE '{VISION_DETAIL_MODE}' (expected one of {', '.join(VISION_DETAIL_MODES)}); using 'adaptive'.")
+    VISION_DETAIL_MODE = "adaptive"
+# Optional JSONL file every vision call is appended to, for tuning the thresholds below
+VISION_USAGE_LOG_PATH = os.getenv("VISION_USAGE_LOG_PATH")
+
+THUMBNAIL_SIZE = 1024     # Complexity is measured on a grayscale box-reduced copy at most this size,
+                          # roughly the resolution "high" detail gets (shortest side 768)
+EDGE_THRESHOLD = 24.0     # Gradient magnitude (0-255 scale) that counts as an edge
+EDGE_WEIGHT = 0.8         # Complexity = weighted mix of edge density and entropy
+ENTROPY_WEIGHT = 0.2
+
+# Detail tiers, checked in order: the first tier whose `max_complexity` is above
+# the image's score is used. `max_side` caps the longest side of the image sent,
+# which bounds the number of 512px tiles billed for "high" (2048 is where OpenAI
+# downscales anyway, so the complex tier costs the same tokens as the full image).
+# Limits of the score: detail finer than ~1/THUMBNAIL_SIZE of the longest side is
+# averaged away before edges are measured, and entropy only breaks ties - on its
+# own it contributes at most ENTROPY_WEIGHT (0.2), so it cannot leave "simple".
+DETAIL_TIERS = [
+    {"name": "simple",   "max_complexity": 0.20, "detail": "low",  "max_side": 512},
+    {"name": "moderate", "max_complexity": 0.35, "detail": "high", "max_side": 512},
+    {"name": "complex",  "max_complexity": math.inf, "detail": "high", "max_side": 2048},
+]
+
+# Recent vision calls, newest last (also written to VISION_USAGE_LOG_PATH if set);
+# read it through summarize_usage()
+USAGE_LOG = deque(maxlen=500)
+_usage_lock = threading.Lock()
+
+
+def estimate_complexity(image: Image.Image) -> dict:
+    """Estimates visual complexity from edge density and grayscale entropy of a reduced copy."""
+    # Integer box reduce (cheap, no antialias blur) to at most THUMBNAIL_SIZE on the longest side
+    factor = math.ceil(max(image.size) / THUMBNAIL_SIZE)
+    thumb = (image.reduce(factor) if factor > 1 else image).convert("L")
+    pixels = np.asarray(thumb, dtype=np.float32)
+
+    # Edge density: share of pixels with a strong horizontal/vertical gradient
+    if min(pixels.shape) > 1:
+        grad_x = np.abs(np.diff(pixels, axis=1))[:-1, :]
+        grad_y = np.abs(np.diff(pixels, axis=0))[:, :-1]
+        edge_density = float(np.mean(np.hypot(grad_x, grad_y) > EDGE_THRESHOLD))
+    else:
+        edge_density = 0.0
+
+    # Shannon entropy of the grayscale histogram, normalized to 0-1 (8 bits max)
+    hist = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    probs = hist[hist > 0] / hist.sum()
+    entropy = float(abs((probs * np.log2(probs)).sum()) / 8.0)
+
+    score = EDGE_WEIGHT * edge_density + ENTROPY_WEIGHT * entropy
+    return {"complexity": score, "edge_density": edge_density, "entropy": entropy}
+
+
+def estimate_vision_tokens(width: int, height: int, detail: str) -> int:
+    """Estimates the prompt tokens billed for one image, following OpenAI's tiling rules."""
+    if detail == "low":
+        return 85
+    # Fit within 2048x2048, then shrink so the shortest side is at most 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def select_detail(image: Image.Image, fixed_detail: str = "high", ceiling: str = "high") -> dict:
+    """
+    Chooses the `detail` level and size cap for sending `image` to a vision model.
+    In "fixed" mode `fixed_detail` is used unchanged. `ceiling="low"` always sends
+    "low" without estimating complexity (the image is still downscaled to what
+    "low" actually uses) and is logged as tier "capped".
+    """
+    if VISION_DETAIL_MODE != "adaptive":
+        return {"mode": VISION_DETAIL_MODE, "tier": None, "detail": fixed_detail, "max_side": None}
+    if ceiling == "low":
+        return {"mode": "adaptive", "tier": "capped", "detail": "low", "max_side": 512}
+
+    stats = estimate_complexity(image)
+    tier = next(t for t in DETAIL_TIERS if stats["complexity"] < t["max_complexity"])
+    stats = {key: round(value, 4) for key, value in stats.items()} # Rounded for logging only
+    return {"mode": "adaptive", "tier": tier["name"], "detail": tier["detail"], "max_side": tier["max_side"], **stats}
+
+
+def prepare_image(image: Image.Image, plan: dict) -> Image.Image:
+    """Returns `image` downscaled to the plan's `max_side` (keeps the original if already small enough)."""
+    max_side = plan.get("max_side")
+    if not max_side or max(image.size) <= max_side:
+        return image
+    resized = image.copy()
+    resized.thumbnail((max_side, max_side), Image.LANCZOS)
+    resized.format = image.format
+    return resized
+
+
+def record_vision_usage(call: str, plan: dict, image_size: tuple, response, latency_s: float) -> dict:
+    """Records token usage and latency of a vision call next to the detail plan that produced it."""
+    usage = getattr(response, "usage", None)
+    entry = {
+        "timestamp": time.time(),
+        "call": call,
+        **plan,
+        "image_size": list(image_size),
+        "estimated_prompt_tokens": estimate_vision_tokens(*image_size, plan["detail"]),
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "latency_s": round(latency_s, 3),
+    }
+    with _usage_lock:
+        USAGE_LOG.append(entry)
+        if VISION_USAGE_LOG_PATH:
+            try:
+                with open(VISION_USAGE_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                print(f"Could not write vision usage log: {e}")
+    print(f"📊 Vision call '{call}': detail={entry['detail']}, tier={entry['tier']}, "
+          f"prompt_tokens={entry['prompt_tokens']}, latency={entry['latency_s']}s")
+    return entry
+
+
+def summarize_usage() -> dict:
+    """Aggregates the recent vision calls in USAGE_LOG by call and tier (count, tokens, latency)."""
+    with _usage_lock:
+        entries = list(USAGE_LOG)
+    groups = {}
+    for entry in entries:
+        groups.setdefault(f"{entry['call']}/{entry['tier']}", []).append(entry)
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        tokens = [e["prompt_tokens"] for e in group if e["prompt_tokens"] is not None]
+        latencies = sorted(e["latency_s"] for e in group)
+        summary[key] = {
+            "count": len(group),
+            "detail": group[-1]["detail"],
+            "mean_prompt_tokens": round(sum(tokens) / len(tokens), 1) if tokens else None,
+            "p95_latency_s": latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)],
+        }
+    return summary